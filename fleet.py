@@ -0,0 +1,433 @@
+# fleet.py
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils import FAULT_TEMPLATES, FIELDS, init_vehicle_state
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:  # numba is optional; kernels then run as plain Python
+    HAVE_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        return lambda fn: fn
+
+try:
+    import cupy
+except ImportError:  # cupy is optional; only simulate_step_batch_gpu needs it
+    cupy = None
+
+# Fleet state is a Structure-of-Arrays block: a float32 array of shape (8, n)
+# with one row per field (in utils.FIELDS order) and one column per vehicle.
+RPM, SPEED, THROTTLE, COOLANT_TEMP, FUEL_RATE, MAF, OIL_TEMP, LOAD = range(len(FIELDS))
+
+# Driving modes are passed as integer codes indexing these tables
+DRIVING_MODES = ("Eco", "Normal", "Sport")
+MODE_AGGRESSION = np.array([0.6, 1.0, 1.3], dtype=np.float32)
+MODE_FUEL = np.array([0.9, 1.0, 1.15], dtype=np.float32)
+_MODE_CODE = {m: i for i, m in enumerate(DRIVING_MODES)}
+
+# Sensor noise amplitude for rpm, coolant_temp, oil_temp
+_NOISE_SCALE = np.array([[30.0], [0.2], [0.1]], dtype=np.float32)
+
+# Display precision per field, applied by round_states()
+_DECIMALS = ((RPM, 0), (SPEED, 1), (THROTTLE, 1), (COOLANT_TEMP, 1), (FUEL_RATE, 3), (MAF, 2), (OIL_TEMP, 1), (LOAD, 1))
+_ROUND_SCALE = np.array([[10.0 ** decimals] for _, decimals in sorted(_DECIMALS)], dtype=np.float32)
+
+# Amplitudes of the single-vehicle noise columns: rpm, coolant_temp, oil_temp
+_STEP_NOISE_SCALE = np.array([20.0, 0.2, 0.1])
+
+# One generator for the whole process (SFC64: the fastest bit generator numpy ships)
+_rng = np.random.Generator(np.random.SFC64())
+_gpu_rng = None
+_device_tables = None
+
+# Smallest chunk of vehicles worth handing to a worker thread
+_MIN_CHUNK = 16384
+_pools = {}
+
+def init_vehicle_states(n):
+    """
+    Initial state for n simulated vehicles, as an (8, n) float32 block.
+    Every vehicle starts from the init_vehicle_state() defaults.
+    """
+    state = init_vehicle_state()
+    column = np.array([state[f] for f in FIELDS], dtype=np.float32)
+    return np.repeat(column[:, None], n, axis=1)
+
+def mode_codes(driving_modes):
+    """Map driving mode names ("Eco", "Normal", "Sport") to integer codes; unknown names map to Normal."""
+    normal = _MODE_CODE["Normal"]
+    return np.array([_MODE_CODE.get(m, normal) for m in driving_modes], dtype=np.intp)
+
+def simulate_step_batch(states, accel_request=0.0, road_slope=0.0, dt=1.0, modes=1, rng=None, emit_faults=False):
+    """
+    Advance every vehicle in `states` by one timestep (dt seconds), in place.
+    Same dynamics as utils.simulate_step, vectorized over the vehicle axis,
+    but the rpm noise differs: one continuous +/-30 draw applied before the
+    fuel and MAF terms, where the scalar step adds +/-20 there and a further
+    integer +/-10 jitter after them.
+    - accel_request: driver demand (-1.0 .. 1.0), scalar or one value per vehicle
+    - road_slope: incline in degrees, scalar or one value per vehicle
+    - modes: driving mode code (see mode_codes), scalar or one per vehicle
+    - rng: numpy Generator for sensor noise (module default if None)
+    - emit_faults: also run check_faults_batch() on the new values
+    Returns `states`, or (states, faults) with emit_faults=True.
+    """
+    xp = _array_module(states)
+    rng = _default_rng(xp) if rng is None else rng
+    mode_aggression, mode_fuel, noise_scale = _tables(xp)
+    n = states.shape[1]
+    rpm, speed, throttle, coolant_temp, fuel_rate, maf, oil_temp, load = states
+
+    # Driver demand -> throttle, with smoothing
+    requested_throttle = accel_request * mode_aggression[modes] * 50.0 + throttle
+    np.clip(requested_throttle, 0.0, 100.0, out=requested_throttle)
+    throttle += (requested_throttle - throttle) * 0.2
+
+    # Speed dynamics: thrust ~ throttle, drag ~ speed^2, slope effect
+    thrust = throttle * 0.05
+    drag = 0.0002 * speed * speed  # 0.02 * speed^2 / 100
+    slope_effect = -road_slope * 0.2
+    speed += (thrust - drag + slope_effect) * dt
+    np.maximum(speed, 0.0, out=speed)
+
+    # One noise draw per tick for all vehicles: rpm jitter, coolant and oil drift
+    noise = rng.random((3, n), dtype=np.float32)
+    noise *= 2.0
+    noise -= 1.0
+    noise *= noise_scale
+
+    # RPM follows speed through a fixed gear ratio; both jitter terms folded into one
+    target_rpm = speed * 120.0 + throttle * 2  # gear ratio 4.0 * 30
+    np.maximum(target_rpm, 700.0, out=target_rpm)
+    rpm += (target_rpm - rpm) * 0.25 + noise[0]
+    np.maximum(rpm, 600.0, out=rpm)
+
+    # Temperatures drift towards an operating temp set by (last tick's) load
+    engine_temp_target = 70.0 + load * 0.2
+    coolant_temp += (engine_temp_target - coolant_temp) * 0.05 + noise[1]
+    oil_temp += (engine_temp_target - oil_temp) * 0.03 + noise[2]
+
+    load[:] = throttle * 0.6 + speed * 0.5
+    np.clip(load, 0.0, 100.0, out=load)
+
+    base_fuel = 0.3 + rpm * (2.0 / 6000.0)
+    fuel_rate[:] = base_fuel * (1.0 + load * 0.01) * mode_fuel[modes]
+    maf[:] = 1.0 + rpm * throttle * 2e-5
+
+    if emit_faults:
+        return states, check_faults_batch(states, rng)
+    return states
+
+def _array_module(a):
+    # numpy, or cupy for state blocks that live on the GPU
+    return cupy.get_array_module(a) if cupy is not None else np
+
+def _default_rng(xp):
+    global _gpu_rng
+    if xp is np:
+        return _rng
+    if _gpu_rng is None:
+        _gpu_rng = cupy.random.default_rng()
+    return _gpu_rng
+
+def _tables(xp):
+    # Mode tables and noise scale on the same device as the state block
+    global _device_tables
+    if xp is np:
+        return MODE_AGGRESSION, MODE_FUEL, _NOISE_SCALE
+    if _device_tables is None:
+        _device_tables = tuple(cupy.asarray(t) for t in (MODE_AGGRESSION, MODE_FUEL, _NOISE_SCALE))
+    return _device_tables
+
+def simulate_step_batch_gpu(states, accel_request=0.0, road_slope=0.0, dt=1.0, modes=1, rng=None, emit_faults=False):
+    """
+    simulate_step_batch for a state block held on the GPU, e.g.
+    cupy.asarray(init_vehicle_states(n)); the same array code runs through
+    cupy. Per-vehicle arguments may be host arrays, they are copied over.
+    Fault dicts come back to the host as usual.
+    """
+    if cupy is None:
+        raise RuntimeError("cupy is not installed; GPU stepping is unavailable")
+    if not isinstance(states, cupy.ndarray):
+        raise TypeError("states must be a cupy array (see cupy.asarray)")
+
+    def to_device(x):
+        return cupy.asarray(x) if np.ndim(x) else x
+
+    return simulate_step_batch(
+        states, to_device(accel_request), to_device(road_slope), dt, to_device(modes),
+        rng=rng, emit_faults=emit_faults,
+    )
+
+def _pool(workers):
+    pool = _pools.get(workers)
+    if pool is None:
+        pool = _pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fleet")
+    return pool
+
+def _take(x, cols):
+    # Per-vehicle arguments are sliced with the chunk, scalars pass through
+    return x[cols] if np.ndim(x) else x
+
+def simulate_step_batch_parallel(states, accel_request=0.0, road_slope=0.0, dt=1.0, modes=1, workers=None, emit_faults=False):
+    """
+    simulate_step_batch split into column chunks stepped on a thread pool.
+    NumPy releases the GIL inside its array loops, so big fleets scale across
+    cores; fleets too small to split just run the serial step. Each chunk
+    draws noise from its own Generator, spawned from the module one.
+    Returns `states`, or (states, faults) with emit_faults=True.
+    """
+    n = states.shape[1]
+    workers = max(1, min(workers or os.cpu_count() or 1, n // _MIN_CHUNK))
+    if workers == 1:
+        return simulate_step_batch(states, accel_request, road_slope, dt, modes, emit_faults=emit_faults)
+
+    bounds = np.linspace(0, n, workers + 1).astype(int)
+    chunks = [slice(a, b) for a, b in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+    seeds = np.random.SeedSequence(int(_rng.integers(1 << 63))).spawn(workers)
+
+    def step(cols, seed):
+        return simulate_step_batch(
+            states[:, cols], _take(accel_request, cols), _take(road_slope, cols), dt, _take(modes, cols),
+            rng=np.random.default_rng(seed), emit_faults=emit_faults,
+        )
+
+    results = list(_pool(workers).map(step, chunks, seeds))
+    if not emit_faults:
+        return states
+    faults = []
+    for cols, (_, chunk_faults) in zip(chunks, results):
+        for fault in chunk_faults:
+            fault["vehicle"] += cols.start
+        faults.extend(chunk_faults)
+    return states, faults
+
+def check_faults_batch(states, rng=None):
+    """
+    utils.check_faults over a whole fleet. The rules are evaluated as masks
+    over the vehicle axis; fault dicts (with a "vehicle" index added) are
+    only built for the vehicles that actually tripped one.
+    """
+    xp = _array_module(states)
+    rng = _default_rng(xp) if rng is None else rng
+    rpm, coolant_temp, oil_temp = states[RPM], states[COOLANT_TEMP], states[OIL_TEMP]
+    overheat = coolant_temp > 105
+    misfire = (rpm < 700) & (rng.random(states.shape[1]) < 0.02)
+    cold_oil = oil_temp < 40
+
+    faults = []
+    for mask, fault in zip((overheat, misfire, cold_oil), FAULT_TEMPLATES):
+        if not mask.any():
+            continue
+        hits = xp.flatnonzero(mask)
+        if xp is not np:
+            hits = hits.get()
+        faults.extend({"vehicle": i, **fault} for i in hits.tolist())
+    return faults
+
+def states_to_bytes(states):
+    """
+    Serialize a state block as a fleet block: raw little-endian float32,
+    field-major (all rpm values, then all speeds, ...). One copy, no per-field
+    encoding. This differs from the vehicle-major frames of utils.pack_state();
+    decode it only with states_from_bytes().
+    """
+    return np.ascontiguousarray(states, dtype="<f4").tobytes()
+
+def states_from_bytes(buf):
+    """
+    Inverse of states_to_bytes(): an (8, n) view of a fleet block. The result
+    is read-only; copy it before stepping.
+    """
+    return np.frombuffer(buf, dtype="<f4").reshape(len(FIELDS), -1)
+
+# Fixed-point layout for int16 storage: q = rint(value * scale + offset).
+# Resolution per field: rpm 1, speed/throttle/temps/load 0.1, fuel_rate 0.001,
+# maf 0.01; temperatures are offset so -40 C maps to 0.
+_Q_SCALE = np.array([1, 10, 10, 10, 1000, 100, 10, 10], dtype=np.float32)
+_Q_OFFSET = np.array([0, 0, 0, 400, 0, 0, 400, 0], dtype=np.float32)
+
+def _per_field(a, ndim):
+    # Shape a per-field table to broadcast against one state (8,) or a block (8, n)
+    return a.reshape((-1,) + (1,) * (ndim - 1))
+
+def pack_q(states):
+    """
+    Quantize one state vector (8,) or a state block (8, n) to int16 fixed
+    point, half the float32 size on the wire. Out-of-range values
+    saturate instead of wrapping.
+    """
+    scale = _per_field(_Q_SCALE, states.ndim)
+    offset = _per_field(_Q_OFFSET, states.ndim)
+    q = states * scale
+    q += offset
+    np.rint(q, out=q)
+    np.clip(q, -32768, 32767, out=q)
+    return q.astype(np.int16)
+
+def unpack_q(q):
+    """Inverse of pack_q(): back to float32 values."""
+    scale = _per_field(_Q_SCALE, q.ndim)
+    offset = _per_field(_Q_OFFSET, q.ndim)
+    states = q.astype(np.float32)
+    states -= offset
+    states /= scale
+    return states
+
+def round_states(states):
+    """
+    Round `states` in place to display precision (see utils.format_state).
+    Call this right before serializing; the simulation itself runs unrounded.
+    """
+    xp = _array_module(states)
+    if xp is np and HAVE_NUMBA:
+        _round_states_nb(states, _ROUND_SCALE[:, 0])
+        return states
+    # Whole block at once: scale every row to its decimals, rint, scale back
+    scale = _ROUND_SCALE if xp is np else xp.asarray(_ROUND_SCALE)
+    states *= scale
+    xp.rint(states, out=states)
+    states /= scale
+    return states
+
+# Fused rounding pass over the block, parallel over vehicles
+@njit(cache=True, parallel=True)
+def _round_states_nb(states, scale):
+    for row in range(states.shape[0]):
+        p = scale[row]
+        for i in prange(states.shape[1]):
+            states[row, i] = np.rint(states[row, i] * p) / p
+
+class NoiseBuffer:
+    """
+    Sensor noise for the single-vehicle kernel, generated T ticks at a time.
+    Each row is one tick: rpm, coolant and oil drift (already scaled) and the
+    integer rpm sensor jitter (-10..10). take() hands out rows in order and
+    regenerates the whole buffer once it is used up.
+    """
+
+    def __init__(self, T=4096, rng=None):
+        self.rng = _rng if rng is None else rng
+        self.noise = np.empty((T, 4))
+        self.t = T  # empty until the first take()
+
+    def refill(self):
+        # Regenerated in place: one uniform fill, then per-column transforms
+        self.rng.random(out=self.noise)
+        drift, jitter = self.noise[:, :3], self.noise[:, 3]
+        drift *= 2.0
+        drift -= 1.0
+        drift *= _STEP_NOISE_SCALE
+        jitter *= 21.0
+        np.floor(jitter, out=jitter)
+        jitter -= 10.0
+        self.t = 0
+
+    def take(self):
+        return self.noise[self.next_index()]
+
+    def next_index(self):
+        # Row index for the next tick, refilling when the buffer is used up
+        t = self.t
+        if t == len(self.noise):
+            self.refill()
+            t = 0
+        self.t = t + 1
+        return t
+
+_noise_buffer = NoiseBuffer()
+
+# Single-vehicle kernel: the state is a float64 array of length 8 indexed by
+# the row constants above, noise is row t of a NoiseBuffer. Compiled eagerly
+# at import (explicit signature) and cached on disk so later processes skip
+# the compile.
+@njit("void(float64[::1], float64[:, ::1], int64, float64, float64, float64, int64)", cache=True, fastmath=True)
+def _simulate_step_nb(s, noise_rows, t, accel_request, road_slope, dt, mode):
+    noise = noise_rows[t]
+    if mode == 0:
+        mode_aggression = 0.6
+        fuel_mode_mul = 0.9
+    elif mode == 2:
+        mode_aggression = 1.3
+        fuel_mode_mul = 1.15
+    else:
+        mode_aggression = 1.0
+        fuel_mode_mul = 1.0
+
+    throttle = s[THROTTLE]
+    # Clamps as conditional expressions, which lower to branchless min/max
+    requested_throttle = accel_request * mode_aggression * 50.0 + throttle
+    requested_throttle = 0.0 if requested_throttle < 0.0 else (100.0 if requested_throttle > 100.0 else requested_throttle)
+    throttle = throttle + (requested_throttle - throttle) * 0.2
+
+    speed = s[SPEED]
+    thrust = throttle * 0.05
+    drag = 0.0002 * speed * speed  # 0.02 * speed^2 / 100
+    slope_effect = -road_slope * 0.2
+    speed += (thrust - drag + slope_effect) * dt
+    speed = speed if speed > 0.0 else 0.0
+
+    target_rpm = speed * 120.0 + throttle * 2  # gear ratio 4.0 * 30
+    target_rpm = target_rpm if target_rpm > 700.0 else 700.0
+    rpm = s[RPM]
+    rpm = rpm + (target_rpm - rpm) * 0.25 + noise[0]
+
+    load = s[LOAD]
+    engine_temp_target = 70.0 + load * 0.2
+    coolant_temp = s[COOLANT_TEMP] + (engine_temp_target - s[COOLANT_TEMP]) * 0.05 + noise[1]
+    oil_temp = s[OIL_TEMP] + (engine_temp_target - s[OIL_TEMP]) * 0.03 + noise[2]
+
+    load = throttle * 0.6 + speed * 0.5
+    load = 0.0 if load < 0.0 else (100.0 if load > 100.0 else load)
+
+    base_fuel = 0.3 + rpm * (2.0 / 6000.0)
+    fuel_rate = base_fuel * (1.0 + load * 0.01) * fuel_mode_mul
+    maf = 1.0 + rpm * throttle * 2e-5
+
+    rpm += noise[3]
+    s[RPM] = rpm if rpm > 600.0 else 600.0
+    s[SPEED] = speed
+    s[THROTTLE] = throttle
+    s[COOLANT_TEMP] = coolant_temp
+    s[FUEL_RATE] = fuel_rate
+    s[MAF] = maf
+    s[OIL_TEMP] = oil_temp
+    s[LOAD] = load
+
+def init_vehicle_array():
+    """Initial single-vehicle state for step_vehicle(): float64[8] in FIELDS order."""
+    state = init_vehicle_state()
+    return np.array([state[f] for f in FIELDS], dtype=np.float64)
+
+def step_vehicle(s, noise=None, accel_request=0.0, road_slope=0.0, dt=1.0, mode=1):
+    """
+    Advance one vehicle held as a float64[8] array (see init_vehicle_array)
+    by one timestep, in place, with the compiled kernel. This is the fast
+    single-vehicle path: keep `s` and its NoiseBuffer across ticks and read
+    fields by index (RPM, SPEED, ...). Only worthwhile with numba installed
+    (HAVE_NUMBA); without it, utils.simulate_step is faster.
+    - noise: NoiseBuffer to draw sensor noise from (module default if None)
+    - mode: driving mode code (see mode_codes)
+    """
+    noise = _noise_buffer if noise is None else noise
+    _simulate_step_nb(s, noise.noise, noise.next_index(), accel_request, road_slope, dt, mode)
+    return s
+
+def simulate_step_fast(state, accel_request=0.0, road_slope=0.0, dt=1.0, driving_mode="Normal", noise=None):
+    """
+    Convenience wrapper: step_vehicle() on a state dict, updated in place
+    and returned. Copying the dict into and out of an array costs more than
+    the kernel saves, so this is not a fast path; use step_vehicle() with a
+    persistent array for that. Unlike utils.simulate_step it takes only dicts
+    and has no emit_faults/rng options.
+    """
+    s = np.array([state[f] for f in FIELDS], dtype=np.float64)
+    step_vehicle(s, noise, accel_request, road_slope, dt, _MODE_CODE.get(driving_mode, 1))
+    state.update(zip(FIELDS, s.tolist()))
+    return state
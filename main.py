@@ -1,12 +1,11 @@
 import streamlit as st
 import pandas as pd
-import time
-import random
+import numpy as np
+import pyarrow as pa
 import logging
+import time
 from datetime import datetime
 import plotly.graph_objects as go
-import plotly.express as px
-import uuid
 import os
 import json
 
@@ -30,25 +29,62 @@ logger = logging.getLogger(__name__)
 # ================================
 # --- SESSION STATE ---
 # ================================
-def _empty_log_df():
-    return pd.DataFrame({
-        "Time": pd.Series(dtype="string"),
-        "RPM": pd.Series(dtype="int32"),
-        "Speed": pd.Series(dtype="float32"),
-        "Temp": pd.Series(dtype="float32"),
-        "Fuel Level": pd.Series(dtype="float32"),
-    })
+LOG_DTYPES = {
+    "Time": "datetime64[ns]",
+    "RPM": np.int32,
+    "Speed": np.float32,
+    "Temp": np.float32,
+    "Fuel Level": np.float32,
+}
+
+# Telemetry state: a float32 array with one lane per channel
+RPM, SPEED, TEMP, FUEL = range(4)
+TELEMETRY_INIT = (900.0, 0.0, 75.0, 100.0)
+TELEMETRY_MIN = np.array([800, 0, 70, 0], dtype=np.float32)
+TELEMETRY_MAX = np.array([6500, 220, 125, 100], dtype=np.float32)
+
+# Log timestamps are wall-clock local time stored as int64 nanoseconds
+_LOCAL_UTC_OFFSET_NS = int(datetime.now().astimezone().utcoffset().total_seconds()) * 1_000_000_000
+
+def _new_telemetry():
+    return np.array(TELEMETRY_INIT, dtype=np.float32)
+
+def _empty_log(capacity: int):
+    """Preallocated ring buffer for the telemetry log (one typed array per column)."""
+    return {
+        "columns": {name: np.empty(capacity, dtype=dtype) for name, dtype in LOG_DTYPES.items()},
+        "write_idx": 0,  # next slot to overwrite
+        "size": 0,       # rows currently held (<= capacity)
+        "count": 0,      # rows logged since the last reset
+        # Running aggregates for the metrics panel
+        "speed_sum": 0.0,  # sum of Speed over the rows held
+        "rpm_max": 0,      # highest RPM logged since the last reset
+    }
+
+def _ordered_columns(log):
+    """Copies of the column arrays in chronological order (oldest row first)."""
+    size, write_idx = log["size"], log["write_idx"]
+    out = {}
+    for name, arr in log["columns"].items():
+        if size < len(arr):
+            out[name] = arr[:size].copy()
+        else:
+            out[name] = np.roll(arr, -write_idx)
+    return out
+
+def _resize_log(log, capacity: int):
+    """Rebuild the ring buffer with a new capacity, keeping the most recent rows."""
+    new_log = _empty_log(capacity)
+    keep = min(log["size"], capacity)
+    for name, arr in _ordered_columns(log).items():
+        new_log["columns"][name][:keep] = arr[len(arr) - keep:]
+    new_log["size"] = keep
+    new_log["write_idx"] = keep % capacity
+    new_log["count"] = log["count"]
+    new_log["speed_sum"] = float(new_log["columns"]["Speed"][:keep].sum(dtype=np.float64))
+    new_log["rpm_max"] = log["rpm_max"]
+    return new_log
 
-if "data_log" not in st.session_state:
-    st.session_state.data_log = _empty_log_df()
-if "running" not in st.session_state:
-    st.session_state.running = False
-if "telemetry" not in st.session_state:
-    st.session_state.telemetry = {"rpm": 900, "speed": 0, "temp": 75, "fuel": 100}
-if "distance_km" not in st.session_state:
-    st.session_state.distance_km = 0.0
-if "last_alerts" not in st.session_state:
-    st.session_state.last_alerts = set()
 if "settings" not in st.session_state:
     st.session_state.settings = {
         "profile": "Normal",  # Eco | Normal | Sport
@@ -59,15 +95,63 @@ if "settings" not in st.session_state:
         "selected_params": ["RPM", "Speed", "Temp", "Fuel Level"],
         "faults": {"heat_spike": False, "fuel_leak": False, "rpm_spike": False},
     }
+if "data_log" not in st.session_state:
+    st.session_state.data_log = _empty_log(int(st.session_state.settings["max_rows"]))
+if "running" not in st.session_state:
+    st.session_state.running = False
+if "telemetry" not in st.session_state:
+    st.session_state.telemetry = _new_telemetry()
+if "distance_km" not in st.session_state:
+    st.session_state.distance_km = 0.0
+if "last_alerts" not in st.session_state:
+    st.session_state.last_alerts = set()
+if "memo" not in st.session_state:
+    st.session_state.memo = {}
+
+def _memo(name, key, build):
+    """Return the value stored under `name` while `key` is unchanged; otherwise rebuild it."""
+    hit = st.session_state.memo.get(name)
+    if hit is not None and hit[0] == key:
+        return hit[1]
+    value = build()
+    st.session_state.memo[name] = (key, value)
+    return value
+
+def _log_version():
+    log = st.session_state.data_log
+    return (log["count"], len(log["columns"]["RPM"]))
+
+def get_log_table(columns, n: int):
+    """Last `n` rows of `columns` as a pyarrow Table read straight from the ring buffer."""
+    log = st.session_state.data_log
+    write_idx = log["write_idx"]
+    start = write_idx - min(n, log["size"])
+    arrays = {}
+    for name in columns:
+        arr = log["columns"][name]
+        # Rows end just before write_idx; a negative start wraps around the buffer
+        chunk = arr[start:write_idx] if start >= 0 else np.concatenate((arr[start:], arr[:write_idx]))
+        arrays[name] = pa.array(chunk)
+    return pa.table(arrays)
+
+def get_log_df():
+    """Materialize the telemetry ring buffer as a DataFrame (once per new row; treat as read-only)."""
+    return _memo("log_df", _log_version(), lambda: pd.DataFrame(_ordered_columns(st.session_state.data_log), copy=False))
 
 # ================================
 # --- THEME / CSS ---
 # ================================
+@st.cache_data
+def _read_css(path: str, mtime: float):
+    # mtime is only part of the cache key, so edits to the file are picked up
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
 def load_css(path: str):
     try:
         if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+            css = _read_css(path, os.path.getmtime(path))
+            st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
     except Exception as e:
         logger.warning(f"Could not load CSS from {path}: {e}")
 
@@ -97,28 +181,21 @@ st.sidebar.markdown(
     unsafe_allow_html=True,
 )
 
-# Export data as CSV
-if not st.session_state.data_log.empty:
-    csv = st.session_state.data_log.to_csv(index=False).encode("utf-8")
-    st.sidebar.download_button("💾 Download CSV", csv, "telemetry_log.csv", "text/csv")
-    # JSON export
-    json_bytes = st.session_state.data_log.to_json(orient="records").encode("utf-8")
-    st.sidebar.download_button("🗂️ Download JSON", json_bytes, "telemetry_log.json", "application/json")
-
 # ================================
 # --- HELPER FUNCTIONS ---
 # ================================
-def update_value(current, min_val, max_val, variation):
-    """Gradually update a telemetry value within limits."""
-    delta = random.uniform(-variation, variation)
-    new_val = current + delta
-    return max(min_val, min(max_val, new_val))
+_rng = np.random.default_rng()
 
-def create_gauge(value, title, min_val, max_val, unit, color):
-    """Generate a Plotly gauge chart."""
+def advance_telemetry(t, variation):
+    """Random-walk every telemetry lane in place, within TELEMETRY_MIN..TELEMETRY_MAX."""
+    t += _rng.uniform(-variation, variation).astype(np.float32)
+    np.clip(t, TELEMETRY_MIN, TELEMETRY_MAX, out=t)
+
+def _build_gauge_template(title, min_val, max_val, unit, color):
+    """Build the static part of a Plotly gauge; only the value changes between ticks."""
     fig = go.Figure(go.Indicator(
         mode="gauge+number",
-        value=value,
+        value=min_val,
         title={'text': title, 'font': {'size': 18, 'color': '#0f172a'}},
         gauge={
             'axis': {'range': [min_val, max_val], 'tickcolor': '#334155'},
@@ -141,35 +218,79 @@ def create_gauge(value, title, min_val, max_val, unit, color):
     )
     return fig
 
-def log_telemetry(t):
-    """Append telemetry data to the session dataframe."""
-    timestamp = datetime.now().strftime("%H:%M:%S.%f")
-    new_row = pd.DataFrame([{
-        "Time": timestamp,
-        "RPM": int(t["rpm"]),
-        "Speed": round(t["speed"], 1),
-        "Temp": round(t["temp"], 1),
-        "Fuel Level": round(t["fuel"], 1)
-    }])
-    st.session_state.data_log = pd.concat(
-        [st.session_state.data_log, new_row],
-        ignore_index=True
+def create_gauge(value, title, min_val, max_val, unit, color):
+    """Return this session's gauge figure for `title` with its value set."""
+    fig = _memo(
+        f"gauge_{title}",
+        (min_val, max_val, unit, color),
+        lambda: _build_gauge_template(title, min_val, max_val, unit, color),
     )
-    # Cap rows to prevent memory bloat
+    fig.data[0].value = value
+    return fig
+
+def lttb_indices(y, n_out):
+    """Largest-Triangle-Three-Buckets: indices of `n_out` points that preserve the shape of `y`."""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # First and last points are always kept; the rest are split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Third triangle vertex: mean of the next bucket (the last point for the final bucket)
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], edges[i + 2]
+            avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return idx
+
+def log_telemetry(t):
+    """Write one telemetry sample into the session ring buffer."""
+    log = st.session_state.data_log
+    # Buffer capacity follows the "Max log rows" setting
     max_rows = int(st.session_state.settings.get("max_rows", 5000))
-    if len(st.session_state.data_log) > max_rows:
-        st.session_state.data_log = st.session_state.data_log.tail(max_rows).reset_index(drop=True)
+    if len(log["columns"]["RPM"]) != max_rows:
+        log = st.session_state.data_log = _resize_log(log, max_rows)
+
+    i = log["write_idx"]
+    cols = log["columns"]
+    if log["size"] == max_rows:
+        log["speed_sum"] -= float(cols["Speed"][i])  # row about to be overwritten
+    cols["Time"][i] = time.time_ns() + _LOCAL_UTC_OFFSET_NS
+    cols["RPM"][i] = int(t[RPM])
+    cols["Speed"][i] = round(t[SPEED], 1)
+    cols["Temp"][i] = round(t[TEMP], 1)
+    cols["Fuel Level"][i] = round(t[FUEL], 1)
+
+    log["speed_sum"] += float(cols["Speed"][i])
+    log["rpm_max"] = max(log["rpm_max"], int(cols["RPM"][i]))
+
+    log["write_idx"] = (i + 1) % max_rows
+    log["size"] = min(log["size"] + 1, max_rows)
+    log["count"] += 1
 
 def generate_alerts(t, thresholds):
     alerts = []
-    if t["temp"] > thresholds.get("temp_high", 110):
+    if t[TEMP] > thresholds.get("temp_high", 110):
         alerts.append("⚠️ Engine Overheating!")
-    if t["fuel"] < thresholds.get("fuel_low", 10):
+    if t[FUEL] < thresholds.get("fuel_low", 10):
         alerts.append("⛽ Low Fuel Level!")
-    if t["rpm"] > thresholds.get("rpm_high", 6000):
+    if t[RPM] > thresholds.get("rpm_high", 6000):
         alerts.append("🚨 RPM limit reached!")
     return alerts
 
+# Points per series sent to the history chart
+CHART_MAX_POINTS = 200
+
 PROFILE_CONFIG = {
     "Eco": {
         "rpm_var": 90,
@@ -194,6 +315,18 @@ PROFILE_CONFIG = {
     },
 }
 
+def resolve_profile(settings):
+    """Fold the driving profile and fault toggles into the constants one tick needs."""
+    prof = PROFILE_CONFIG.get(settings["profile"], PROFILE_CONFIG["Normal"])
+    faults = settings["faults"]
+    rpm_var = prof["rpm_var"] * (1.4 if faults.get("rpm_spike") else 1.0)
+    variation = np.array([rpm_var, prof["speed_var"], prof["temp_var"], 0.0])
+    leak_extra = 0.001 if faults.get("fuel_leak") else 0.0
+    return variation, prof["base_fuel_rate"] + leak_extra, prof["speed_fuel_factor"], bool(faults.get("heat_spike"))
+
+if "resolved_profile" not in st.session_state:
+    st.session_state.resolved_profile = resolve_profile(st.session_state.settings)
+
 # ================================
 # --- BUTTON ACTIONS ---
 # ================================
@@ -204,10 +337,14 @@ elif stop_button:
     st.session_state.running = False
     logger.info("Simulation paused.")
 elif reset_button:
-    st.session_state.data_log = _empty_log_df()
-    st.session_state.telemetry = {"rpm": 900, "speed": 0, "temp": 75, "fuel": 100}
+    st.session_state.data_log = _empty_log(int(st.session_state.settings["max_rows"]))
+    # The log columns carry their final dtypes, so nothing downstream re-coerces them
+    assert all(arr.dtype == np.dtype(LOG_DTYPES[name]) for name, arr in st.session_state.data_log["columns"].items())
+    st.session_state.telemetry = _new_telemetry()
     st.session_state.distance_km = 0.0
     st.session_state.last_alerts = set()
+    st.session_state.memo.clear()
+    st.session_state.pop("export_version", None)
     st.session_state.running = False
     st.success("✅ Data reset complete.")
     logger.info("Data reset complete.")
@@ -215,31 +352,21 @@ elif reset_button:
 # ================================
 # --- SIMULATION UPDATE (ONE STEP) ---
 # ================================
-t = st.session_state.telemetry
-if st.session_state.running:
-    s = st.session_state.settings
-    prof = PROFILE_CONFIG.get(s["profile"], PROFILE_CONFIG["Normal"])
-
-    # Telemetry updates influenced by profile and faults
-    rpm_var = prof["rpm_var"] * (1.4 if s["faults"].get("rpm_spike") else 1.0)
-    speed_var = prof["speed_var"]
-    temp_var = prof["temp_var"]
-
-    t["rpm"] = update_value(t["rpm"], 800, 6500, rpm_var)
-    t["speed"] = update_value(t["speed"], 0, 220, speed_var)
-    t["temp"] = update_value(t["temp"], 70, 125, temp_var)
-    if s["faults"].get("heat_spike"):
-        t["temp"] = min(150, t["temp"] + random.uniform(0.2, 0.8))
-
-    # Fuel consumption model (% per second)
-    base = prof["base_fuel_rate"]
-    factor = prof["speed_fuel_factor"]
-    leak_extra = 0.001 if s["faults"].get("fuel_leak") else 0.0
-    fuel_drop = (base + factor * max(t["speed"], 0) + leak_extra) * interval
-    t["fuel"] = max(0.0, t["fuel"] - fuel_drop * 100)  # convert to %
+def step_simulation(t, interval):
+    """Advance the simulated telemetry by one tick and log it."""
+    # Telemetry updates influenced by profile and faults (resolved when settings change)
+    variation, base, factor, heat_spike = st.session_state.resolved_profile
+
+    advance_telemetry(t, variation)
+    if heat_spike:
+        t[TEMP] = min(150, t[TEMP] + _rng.uniform(0.2, 0.8))
+
+    # Fuel consumption model (% per second); `base` already includes a fuel leak
+    fuel_drop = (base + factor * max(t[SPEED], 0)) * interval
+    t[FUEL] = max(0.0, t[FUEL] - fuel_drop * 100)  # convert to %
 
     # Distance integration (km)
-    st.session_state.distance_km += max(t["speed"], 0) * (interval / 3600.0)
+    st.session_state.distance_km += max(float(t[SPEED]), 0) * (interval / 3600.0)
 
     # Log telemetry
     log_telemetry(t)
@@ -256,7 +383,8 @@ if st.session_state.running:
 # --- MAIN DASHBOARD ---
 # ================================
 
-# We build tabs and widget controls once per run.
+# We build tabs and widget controls once per full run; the panels below are
+# fragments that rerun on their own every `interval` while the simulation runs.
 def get_tabs():
     return st.tabs(["Overview", "Charts", "Data", "Settings"])
 
@@ -265,144 +393,229 @@ def render_overview_controls_and_get_container(tab):
         container = st.container()
     return container
 
-def render_charts_controls_and_get_container(tab, df, key_prefix: str = ""):
+def render_charts_controls_and_get_container(tab, key_prefix: str = ""):
     with tab:
         settings = st.session_state.settings
         cols = ["RPM", "Speed", "Temp", "Fuel Level"]
         selected = st.multiselect("Parameters", cols, key=f"{key_prefix}charts_params", default=[c for c in settings["selected_params"] if c in cols])
         settings["selected_params"] = selected or cols
 
-        points_window = st.slider("Points window", min_value=100, max_value=5000, value=int(settings["points_window"]), key=f"{key_prefix}charts_points")
+        # Slider state is seeded from the settings defaults; "Apply" in the settings tab resets it
+        st.session_state.setdefault(f"{key_prefix}charts_points", int(settings["points_window"]))
+        st.session_state.setdefault(f"{key_prefix}charts_smooth", int(settings["smoothing_window"]))
+
+        points_window = st.slider("Points window", min_value=100, max_value=5000, key=f"{key_prefix}charts_points")
         settings["points_window"] = int(points_window)
 
-        smooth = st.slider("Smoothing window (rolling)", min_value=1, max_value=50, value=int(settings["smoothing_window"]), key=f"{key_prefix}charts_smooth")
+        smooth = st.slider("Smoothing window (rolling)", min_value=1, max_value=50, key=f"{key_prefix}charts_smooth")
         settings["smoothing_window"] = int(smooth)
 
         container = st.container()
     return container
 
-def render_data_controls_and_get_container(tab, df, key_prefix: str = ""):
+def render_data_controls_and_get_container(tab, key_prefix: str = ""):
     with tab:
         st.markdown("#### 🔍 Recorded Data")
-        cols = list(df.columns)
+        cols = list(LOG_DTYPES)
         view_cols = st.multiselect("Columns", cols, default=cols, key=f"{key_prefix}data_columns")
         query = st.text_input("Filter contains", "", key=f"{key_prefix}data_filter")
         container = st.container()
     return container
 
+def _apply_settings(key_prefix: str):
+    """Copy the submitted settings form into the session settings (runs before the rerun)."""
+    ss = st.session_state
+    s = ss.settings
+    s["profile"] = ss[f"{key_prefix}settings_profile"]
+    s["thresholds"]["temp_high"] = float(ss[f"{key_prefix}th_temp_high"])
+    s["thresholds"]["fuel_low"] = float(ss[f"{key_prefix}th_fuel_low"])
+    s["thresholds"]["rpm_high"] = int(ss[f"{key_prefix}th_rpm_high"])
+    s["max_rows"] = int(ss[f"{key_prefix}set_max_rows"])
+    s["points_window"] = int(ss[f"{key_prefix}set_points_window"])
+    s["smoothing_window"] = int(ss[f"{key_prefix}set_smoothing_window"])
+    for fault in ("heat_spike", "fuel_leak", "rpm_spike"):
+        s["faults"][fault] = bool(ss[f"{key_prefix}fault_{fault}"])
+    # The chart tab's sliders start again from the new defaults
+    ss[f"{key_prefix}charts_points"] = s["points_window"]
+    ss[f"{key_prefix}charts_smooth"] = s["smoothing_window"]
+    ss.resolved_profile = resolve_profile(s)
+
 def render_settings(tab, key_prefix: str = ""):
+    # Widgets live in a form, so editing them does not rerun the app until "Apply"
     with tab:
         st.markdown("#### ⚙️ Simulation Settings")
         s = st.session_state.settings
-        s["profile"] = st.selectbox("Driving profile", ["Eco", "Normal", "Sport"], index=["Eco","Normal","Sport"].index(s["profile"]), key=f"{key_prefix}settings_profile")
-        st.markdown("##### Alert thresholds")
-        col1, col2, col3 = st.columns(3)
-        s["thresholds"]["temp_high"] = col1.number_input("Temp high (°C)", value=float(s["thresholds"]["temp_high"]), key=f"{key_prefix}th_temp_high")
-        s["thresholds"]["fuel_low"] = col2.number_input("Fuel low (%)", value=float(s["thresholds"]["fuel_low"]), key=f"{key_prefix}th_fuel_low")
-        s["thresholds"]["rpm_high"] = col3.number_input("RPM high", value=int(s["thresholds"]["rpm_high"]), key=f"{key_prefix}th_rpm_high")
-
-        st.markdown("##### Data & chart")
-        col4, col5 = st.columns(2)
-        s["max_rows"] = int(col4.number_input("Max log rows", min_value=1000, max_value=100000, value=int(s["max_rows"]), key=f"{key_prefix}set_max_rows"))
-        s["points_window"] = int(col5.number_input("Default points window", min_value=100, max_value=5000, value=int(s["points_window"]), key=f"{key_prefix}set_points_window"))
-        s["smoothing_window"] = int(st.number_input("Default smoothing window", min_value=1, max_value=50, value=int(s["smoothing_window"]), key=f"{key_prefix}set_smoothing_window") )
-
-        st.markdown("##### Fault injection (for testing)")
-        fcol1, fcol2, fcol3 = st.columns(3)
-        with fcol1:
-            s["faults"]["heat_spike"] = bool(st.toggle("Heat spike", value=bool(s["faults"].get("heat_spike", False)), key=f"{key_prefix}fault_heat_spike"))
-        with fcol2:
-            s["faults"]["fuel_leak"] = bool(st.toggle("Fuel leak", value=bool(s["faults"].get("fuel_leak", False)), key=f"{key_prefix}fault_fuel_leak"))
-        with fcol3:
-            s["faults"]["rpm_spike"] = bool(st.toggle("RPM spike", value=bool(s["faults"].get("rpm_spike", False)), key=f"{key_prefix}fault_rpm_spike"))
-
-# Build UI: tabs, controls, and containers (once per run)
-df = st.session_state.data_log
+        with st.form(f"{key_prefix}settings_form"):
+            st.selectbox("Driving profile", ["Eco", "Normal", "Sport"], index=["Eco","Normal","Sport"].index(s["profile"]), key=f"{key_prefix}settings_profile")
+            st.markdown("##### Alert thresholds")
+            col1, col2, col3 = st.columns(3)
+            col1.number_input("Temp high (°C)", value=float(s["thresholds"]["temp_high"]), key=f"{key_prefix}th_temp_high")
+            col2.number_input("Fuel low (%)", value=float(s["thresholds"]["fuel_low"]), key=f"{key_prefix}th_fuel_low")
+            col3.number_input("RPM high", value=int(s["thresholds"]["rpm_high"]), key=f"{key_prefix}th_rpm_high")
+
+            st.markdown("##### Data & chart")
+            col4, col5 = st.columns(2)
+            col4.number_input("Max log rows", min_value=1000, max_value=100000, value=int(s["max_rows"]), key=f"{key_prefix}set_max_rows")
+            col5.number_input("Default points window", min_value=100, max_value=5000, value=int(s["points_window"]), key=f"{key_prefix}set_points_window")
+            st.number_input("Default smoothing window", min_value=1, max_value=50, value=int(s["smoothing_window"]), key=f"{key_prefix}set_smoothing_window")
+
+            st.markdown("##### Fault injection (for testing)")
+            fcol1, fcol2, fcol3 = st.columns(3)
+            with fcol1:
+                st.toggle("Heat spike", value=bool(s["faults"].get("heat_spike", False)), key=f"{key_prefix}fault_heat_spike")
+            with fcol2:
+                st.toggle("Fuel leak", value=bool(s["faults"].get("fuel_leak", False)), key=f"{key_prefix}fault_fuel_leak")
+            with fcol3:
+                st.toggle("RPM spike", value=bool(s["faults"].get("rpm_spike", False)), key=f"{key_prefix}fault_rpm_spike")
+
+            st.form_submit_button("Apply", on_click=_apply_settings, args=(key_prefix,))
+
+# Fragments rerun on a timer only while the simulation is running
+run_every = interval if st.session_state.running else None
+
+def _serialize_log():
+    df = get_log_df()
+    export_df = df.assign(Time=df["Time"].dt.strftime("%H:%M:%S.%f"))
+    return {
+        "rows": len(export_df),
+        "csv": export_df.to_csv(index=False).encode("utf-8"),
+        "json": export_df.to_json(orient="records", double_precision=1).encode("utf-8"),
+    }
+
+@st.fragment
+def export_panel():
+    """Serialize the log only when asked; the bytes are reused until the next prepare."""
+    if st.button("📦 Prepare export"):
+        st.session_state.export_version = _log_version()
+    version = st.session_state.get("export_version")
+    if version is None:
+        return
+    export = _memo("export", version, _serialize_log)
+    if not export["rows"]:
+        st.caption("No data recorded yet.")
+        return
+    st.caption(f"{export['rows']} rows ready")
+    # Export data as CSV
+    st.download_button("💾 Download CSV", export["csv"], "telemetry_log.csv", "text/csv")
+    # JSON export
+    st.download_button("🗂️ Download JSON", export["json"], "telemetry_log.json", "application/json")
+
+@st.fragment(run_every=run_every)
+def tick_and_render():
+    """Advance the simulation (while running) and redraw metrics, gauges and alerts."""
+    t = st.session_state.telemetry
+    if st.session_state.running:
+        step_simulation(t, interval)
+    log = st.session_state.data_log
+
+    # Update metrics
+    avg_speed = log["speed_sum"] / log["size"] if log["size"] else 0.0
+    max_rpm = log["rpm_max"]
+    mcol1, mcol2, mcol3, mcol4 = st.columns(4)
+    mcol1.metric("Average Speed", f"{avg_speed:.1f} km/h")
+    mcol2.metric("Max RPM", f"{max_rpm:.0f} rpm")
+    mcol3.metric("Fuel Remaining", f"{t[FUEL]:.1f} %")
+    mcol4.metric("Distance", f"{st.session_state.distance_km:.2f} km")
+
+    # Update gauges; their figures are only touched when a displayed value changes
+    fp = (round(float(t[RPM])), round(float(t[SPEED]), 1), round(float(t[TEMP]), 1), round(float(t[FUEL]), 1))
+    rpm, speed, temp, fuel = fp
+    gauges = _memo("gauges", fp, lambda: [
+        create_gauge(rpm, "Engine RPM", 0, 7000, "rpm", "#007BFF"),
+        create_gauge(speed, "Speed", 0, 250, "km/h", "#28A745"),
+        create_gauge(temp, "Engine Temp", 0, 150, "°C", "#FFC107"),
+        create_gauge(fuel, "Fuel Level", 0, 100, "%", "#DC3545"),
+    ])
+    for col, fig, key in zip(st.columns(4), gauges, ("gauge_rpm", "gauge_speed", "gauge_temp", "gauge_fuel")):
+        col.plotly_chart(fig, key=key, use_container_width=True)
+
+    # Update alerts
+    thresholds = st.session_state.settings["thresholds"]
+    for alert in generate_alerts(t, thresholds):
+        st.warning(alert)
+
+def _build_history_chart(selected, points_window: int, smooth: int):
+    df_plot = get_log_df().tail(points_window)  # read-only view of the shared log frame
+    # WebGL traces, each smoothed out of place and downsampled to the points that matter visually
+    fig = go.Figure()
+    times = df_plot["Time"].to_numpy()
+    for c in selected:
+        series = df_plot[c]
+        if smooth > 1:
+            series = series.rolling(window=smooth, min_periods=1).mean()
+        values = series.to_numpy()
+        idx = lttb_indices(values, CHART_MAX_POINTS)
+        fig.add_trace(go.Scattergl(x=times[idx], y=values[idx], mode="lines", name=c))
+    fig.update_layout(
+        title="Telemetry Over Time",
+        legend_title_text="Parameters",
+        xaxis_title="Time",
+        yaxis_title="Value",
+        xaxis=dict(rangeslider=dict(visible=True)),
+        template='plotly_white',
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        height=420,
+        # Let Plotly.react patch the existing plot in place and keep zoom/legend state across ticks
+        uirevision="main_chart",
+        datarevision=st.session_state.data_log["count"],
+    )
+    return fig
+
+@st.fragment(run_every=run_every)
+def render_chart():
+    cols = ["RPM", "Speed", "Temp", "Fuel Level"]
+    selected = [c for c in st.session_state.settings["selected_params"] if c in cols] or cols
+    points_window = int(st.session_state.settings["points_window"])
+    smooth = int(st.session_state.settings["smoothing_window"])
+    # Rebuild only when the data or the chart options changed since the last draw
+    fp = (_log_version(), tuple(selected), points_window, smooth)
+    fig = _memo("chart", fp, lambda: _build_history_chart(selected, points_window, smooth))
+    st.plotly_chart(fig, use_container_width=True, key="main_chart")
+
+def _filtered_view(query, view_cols):
+    """Last 1000 log rows restricted to `view_cols` and matching `query`."""
+    if not query:
+        return get_log_table(view_cols or list(LOG_DTYPES), 1000)
+    df = get_log_df()
+    view = df[view_cols] if view_cols else df
+    # One vectorized str.contains per column instead of a Python call per row
+    mask = np.zeros(len(view), dtype=bool)
+    for c in view.columns:
+        # Time is matched as clock text (as in the exports), not the full date
+        text = view[c].dt.strftime("%H:%M:%S.%f") if c == "Time" else view[c].astype(str)
+        mask |= text.str.contains(query, case=False, na=False).to_numpy()
+    # Arrow without the index, like the unfiltered branch, so the table keeps its shape
+    return pa.Table.from_pandas(view[mask].tail(1000), preserve_index=False)
+
+@st.fragment(run_every=run_every)
+def render_table():
+    cols_data = list(LOG_DTYPES)
+    view_cols = [c for c in st.session_state.get("ui_data_columns", cols_data) if c in cols_data] if "ui_data_columns" in st.session_state else cols_data
+    query = st.session_state.get("ui_data_filter", "")
+    view = _memo("table_view", (_log_version(), query, tuple(view_cols)), lambda: _filtered_view(query, view_cols))
+    st.dataframe(
+        view,
+        use_container_width=True,
+        column_config={
+            "Time": st.column_config.DatetimeColumn(format="HH:mm:ss.SSS"),
+            **{c: st.column_config.NumberColumn(format="%.1f") for c in ("Speed", "Temp", "Fuel Level")},
+        },
+    )
+
+# Build UI: tabs, controls, and containers (once per full run)
 tab_overview, tab_charts, tab_data, tab_settings = get_tabs()
 overview_container = render_overview_controls_and_get_container(tab_overview)
-charts_container = render_charts_controls_and_get_container(tab_charts, df, key_prefix="ui_")
-data_container = render_data_controls_and_get_container(tab_data, df, key_prefix="ui_")
+charts_container = render_charts_controls_and_get_container(tab_charts, key_prefix="ui_")
+data_container = render_data_controls_and_get_container(tab_data, key_prefix="ui_")
 render_settings(tab_settings, key_prefix="ui_")
 
-# Create stable placeholders once
+# The overview panel goes first so the other panels see this run's tick
 with overview_container:
-    _mcola, _mcolb, _mcolc, _mcold = st.columns(4)
-    metric_placeholders = [_mcola.empty(), _mcolb.empty(), _mcolc.empty(), _mcold.empty()]
-    _g1, _g2, _g3, _g4 = st.columns(4)
-    gauge_placeholders = [_g1.empty(), _g2.empty(), _g3.empty(), _g4.empty()]
-    alerts_placeholder = st.empty()
-
+    tick_and_render()
 with charts_container:
-    chart_placeholder = st.empty()
-
+    render_chart()
 with data_container:
-    table_placeholder = st.empty()
-
-# ================================
-# --- RENDER CURRENT STATE ---
-# ================================
-df_loop = st.session_state.data_log
-
-# Update metrics
-avg_speed = df_loop['Speed'].mean() if not df_loop.empty else 0.0
-max_rpm = df_loop['RPM'].max() if not df_loop.empty else 0
-metric_placeholders[0].metric("Average Speed", f"{avg_speed:.1f} km/h")
-metric_placeholders[1].metric("Max RPM", f"{max_rpm:.0f} rpm")
-metric_placeholders[2].metric("Fuel Remaining", f"{t['fuel']:.1f} %")
-metric_placeholders[3].metric("Distance", f"{st.session_state.distance_km:.2f} km")
-
-# Update gauges
-gauge_placeholders[0].plotly_chart(create_gauge(t["rpm"], "Engine RPM", 0, 7000, "rpm", "#007BFF"), key="gauge_rpm", use_container_width=True)
-gauge_placeholders[1].plotly_chart(create_gauge(t["speed"], "Speed", 0, 250, "km/h", "#28A745"), key="gauge_speed", use_container_width=True)
-gauge_placeholders[2].plotly_chart(create_gauge(t["temp"], "Engine Temp", 0, 150, "°C", "#FFC107"), key="gauge_temp", use_container_width=True)
-gauge_placeholders[3].plotly_chart(create_gauge(t["fuel"], "Fuel Level", 0, 100, "%", "#DC3545"), key="gauge_fuel", use_container_width=True)
-
-# Update alerts
-thresholds = st.session_state.settings["thresholds"]
-alerts = generate_alerts(t, thresholds)
-alerts_placeholder.empty()
-with alerts_placeholder:
-    if alerts:
-        for alert in alerts:
-            st.warning(alert)
-
-# Update charts
-cols = ["RPM", "Speed", "Temp", "Fuel Level"]
-selected = [c for c in st.session_state.settings["selected_params"] if c in cols] or cols
-points_window = int(st.session_state.settings["points_window"])
-smooth = int(st.session_state.settings["smoothing_window"])
-df_plot = df_loop.tail(points_window).copy()
-for col in cols:
-    df_plot[col] = pd.to_numeric(df_plot[col], errors="coerce")
-if smooth > 1:
-    for c in selected:
-        df_plot[c] = df_plot[c].rolling(window=smooth, min_periods=1).mean()
-fig = px.line(df_plot, x="Time", y=selected, title="Telemetry Over Time")
-fig.update_layout(
-    legend_title_text="Parameters",
-    xaxis_title="Time",
-    yaxis_title="Value",
-    xaxis=dict(rangeslider=dict(visible=True)),
-    template='plotly_white',
-    paper_bgcolor='rgba(0,0,0,0)',
-    plot_bgcolor='rgba(0,0,0,0)',
-    height=420,
-)
-chart_placeholder.plotly_chart(fig, use_container_width=True, key="main_chart")
-
-# Update data table
-cols_data = list(df_loop.columns)
-view_cols = [c for c in st.session_state.get("ui_data_columns", cols_data) if c in cols_data] if "ui_data_columns" in st.session_state else cols_data
-query = st.session_state.get("ui_data_filter", "")
-view = df_loop[view_cols] if view_cols else df_loop
-if query:
-    view = view[view.apply(lambda r: r.astype(str).str.contains(query, case=False, na=False).any(), axis=1)]
-table_placeholder.dataframe(view.tail(1000), use_container_width=True)
-
-# ================================
-# --- AUTO-RELOAD FOR SIMULATION ---
-# ================================
-if st.session_state.running:
-    # Streamlit-native rerun to continue simulation without full page reload
-    time.sleep(interval)
-    st.rerun()
\ No newline at end of file
+    render_table()
+with st.sidebar:
+    export_panel()
@@ -1,6 +1,29 @@
 # utils.py
 import random
 import math
+import struct
+import threading
+
+# State fields, in the order every packed/array form of the state uses
+FIELDS = ("rpm", "speed", "throttle", "coolant_temp", "fuel_rate", "maf", "oil_temp", "load")
+
+_tls = threading.local()
+
+def _rng():
+    # One random.Random per thread, so threads stepping vehicles in parallel
+    # never share (or contend on) generator state
+    r = getattr(_tls, "rng", None)
+    if r is None:
+        r = _tls.rng = random.Random()
+    return r
+
+def seed(a=None):
+    """
+    Seed the calling thread's noise generator, for reproducible replays and
+    tests (random.seed() no longer affects the simulation). Each thread
+    has its own generator and seeds it separately.
+    """
+    _tls.rng = random.Random(a)
 
 def init_vehicle_state():
     """
@@ -18,78 +41,193 @@ def init_vehicle_state():
         "load": 10.0          # engine load %
     }
 
-def simulate_step(state, accel_request=0.0, road_slope=0.0, dt=1.0, driving_mode="Normal"):
+class VehicleState:
+    """
+    Vehicle state as slot attributes (same fields as init_vehicle_state()).
+    Attribute access is cheaper than dict lookups on CPython, and PyPy's JIT
+    specializes it further, so the simulation core works on this type.
+    """
+    __slots__ = FIELDS
+
+    def __init__(self, **fields):
+        unknown = fields.keys() - set(FIELDS)
+        if unknown:
+            raise TypeError(f"VehicleState() got unexpected field(s): {', '.join(sorted(unknown))}")
+        values = init_vehicle_state()
+        values.update(fields)
+        for f in FIELDS:
+            setattr(self, f, values[f])
+
+    @classmethod
+    def from_dict(cls, d):
+        v = cls.__new__(cls)
+        for f in FIELDS:
+            setattr(v, f, d[f])
+        return v
+
+    def to_dict(self):
+        return {f: getattr(self, f) for f in FIELDS}
+
+    def __repr__(self):
+        return f"VehicleState({self.to_dict()})"
+
+# Driving mode multipliers (affect aggressiveness and fuel use)
+MODE_AGGRESSION = {"Eco": 0.6, "Normal": 1.0, "Sport": 1.3}
+MODE_FUEL = {"Eco": 0.9, "Normal": 1.0, "Sport": 1.15}
+
+def _make_step(mode_aggression, fuel_mode_mul):
+    # One step function per driving mode, with that mode's multipliers
+    # bound as constants so the per-tick code never branches on the mode.
+    # It works purely on field values and returns the new values in FIELDS
+    # order, so dict and VehicleState callers each read and write their own
+    # fields exactly once with no conversion in between.
+    def step(rpm, speed, throttle, coolant_temp, oil_temp, load, accel_request, road_slope, dt, rng):
+
+        # Update throttle requested by driver
+        # accel_request -1..1 -> throttle 0..100
+        # (clamps are written as conditional expressions: no builtin call per tick)
+        requested_throttle = (accel_request * mode_aggression * 50.0) + throttle
+        requested_throttle = 0.0 if requested_throttle < 0.0 else (100.0 if requested_throttle > 100.0 else requested_throttle)
+        # Add small smoothing
+        throttle += (requested_throttle - throttle) * 0.2
+
+        # Speed dynamics (very simplified)
+        # thrust ~ throttle, resistance ~ speed^2, slope effect
+        thrust = throttle * 0.05  # arbitrary scale to km/h per dt
+        drag = 0.0002 * speed * speed  # 0.02 * speed^2 / 100
+        slope_effect = -road_slope * 0.2  # uphill reduces speed, downhill increases
+        speed += (thrust - drag + slope_effect) * dt
+        speed = speed if speed > 0.0 else 0.0
+
+        # RPM roughly proportional to speed (and throttle when idle)
+        # For low speeds RPM can be higher at idle
+        # gear ratio 4.0 (simplified) * 30 rpm per km/h
+        target_rpm = speed * 120.0 + throttle * 2
+        target_rpm = target_rpm if target_rpm > 700 else 700
+        # Smooth rpm
+        rpm += (target_rpm - rpm) * 0.25 + rng.uniform(-20, 20)
+
+        # Coolant and oil temperature drift towards an operating temp depending on load
+        engine_temp_target = 70.0 + load * 0.2  # base 70 C, + up to 20 depending on load
+        coolant_temp += (engine_temp_target - coolant_temp) * 0.05 + rng.uniform(-0.2, 0.2)
+        oil_temp += (engine_temp_target - oil_temp) * 0.03 + rng.uniform(-0.1, 0.1)
+
+        # Engine load approximated by throttle + speed
+        load = throttle * 0.6 + speed * 0.5
+        load = 0.0 if load < 0.0 else (100.0 if load > 100.0 else load)
+
+        # Fuel rate (L/h) simplified as function of rpm & load & mode
+        base_fuel = 0.3 + rpm * (2.0 / 6000.0)
+        fuel_rate = base_fuel * (1.0 + load * 0.01) * fuel_mode_mul
+        # MAF sensor (mass air flow) proxy
+        maf = 1.0 + rpm * throttle * 2e-5
+
+        # Add small random jitter to mimic sensor noise
+        rpm += rng.randint(-10, 10)
+        rpm = rpm if rpm > 600 else 600
+
+        return rpm, speed, throttle, coolant_temp, fuel_rate, maf, oil_temp, load
+    return step
+
+_DISPATCH = {mode: _make_step(MODE_AGGRESSION[mode], MODE_FUEL[mode]) for mode in MODE_AGGRESSION}
+
+def simulate_step(state, accel_request=0.0, road_slope=0.0, dt=1.0, driving_mode="Normal", emit_faults=False, rng=None):
     """
     Advance the vehicle state by one timestep (dt seconds).
     - accel_request: driver demand (-1.0 .. 1.0), negative for braking
     - road_slope: incline (positive uphill in degrees, negative downhill)
     - driving_mode: "Eco", "Normal", "Sport"
-    Returns a new state dict.
+    - emit_faults: also run the check_faults() rules on the new values
+    - rng: random.Random for sensor noise (this thread's generator if None, see seed())
+    `state` may be a state dict or a VehicleState.
+    Updates `state` in place and returns it (no copy is made; callers that
+    need the previous values must copy the dict themselves). Values are kept
+    at full precision, rpm included; use format_state() for display.
+    With emit_faults=True returns (state, faults) instead.
     """
-    s = state.copy()
-
-    # Driving mode multipliers (affect aggressiveness)
-    mode_aggression = {"Eco": 0.6, "Normal": 1.0, "Sport": 1.3}.get(driving_mode, 1.0)
-
-    # Update throttle requested by driver
-    # accel_request -1..1 -> throttle 0..100
-    requested_throttle = max(0.0, min(100.0, (accel_request * mode_aggression * 50.0) + s["throttle"]))
-    # Add small smoothing
-    s["throttle"] = s["throttle"] + (requested_throttle - s["throttle"]) * 0.2
-
-    # Speed dynamics (very simplified)
-    # thrust ~ throttle, resistance ~ speed^2, slope effect
-    thrust = s["throttle"] * 0.05  # arbitrary scale to km/h per dt
-    drag = 0.02 * (s["speed"] ** 2) / 100.0
-    slope_effect = -road_slope * 0.2  # uphill reduces speed, downhill increases
-    s["speed"] = max(0.0, s["speed"] + (thrust - drag + slope_effect) * (dt / 1.0))
-
-    # RPM roughly proportional to speed (and throttle when idle)
-    # For low speeds RPM can be higher at idle
-    gear_ratio = 4.0  # simplified
-    target_rpm = max(700, (s["speed"] * gear_ratio * 30) + s["throttle"] * 2)
-    # Smooth rpm
-    s["rpm"] = int(s["rpm"] + (target_rpm - s["rpm"]) * 0.25 + random.uniform(-20, 20))
-
-    # Coolant and oil temperature drift towards an operating temp depending on load
-    engine_temp_target = 70.0 + (s["load"] / 100.0) * 20.0  # base 70 C, + up to 20 depending on load
-    s["coolant_temp"] += (engine_temp_target - s["coolant_temp"]) * 0.05 + random.uniform(-0.2, 0.2)
-    s["oil_temp"] += (engine_temp_target - s["oil_temp"]) * 0.03 + random.uniform(-0.1, 0.1)
-
-    # Engine load approximated by throttle + speed
-    s["load"] = min(100.0, max(0.0, s["throttle"] * 0.6 + (s["speed"] / 2.0)))
-
-    # Fuel rate (L/h) simplified as function of rpm & load & mode
-    base_fuel = 0.3 + (s["rpm"] / 6000.0) * 2.0
-    s["fuel_rate"] = base_fuel * (1.0 + s["load"] / 100.0) * (1.0 if driving_mode == "Normal" else (0.9 if driving_mode == "Eco" else 1.15))
-    # MAF sensor (mass air flow) proxy
-    s["maf"] = 1.0 + (s["rpm"] / 1000.0) * (s["throttle"] / 100.0) * 2.0
-
-    # Add small random jitter to mimic sensor noise
-    s["rpm"] = int(max(600, s["rpm"] + random.randint(-10, 10)))
-    s["coolant_temp"] = round(s["coolant_temp"], 1)
-    s["oil_temp"] = round(s["oil_temp"], 1)
-    s["maf"] = round(s["maf"], 2)
-    s["fuel_rate"] = round(s["fuel_rate"], 3)
-    s["speed"] = round(s["speed"], 1)
-    s["throttle"] = round(s["throttle"], 1)
-    s["load"] = round(s["load"], 1)
+    step = _DISPATCH.get(driving_mode) or _DISPATCH["Normal"]
+    rng = _rng() if rng is None else rng
+    s = state
+    if isinstance(s, VehicleState):
+        new = step(s.rpm, s.speed, s.throttle, s.coolant_temp, s.oil_temp, s.load,
+                   accel_request, road_slope, dt, rng)
+        s.rpm, s.speed, s.throttle, s.coolant_temp, s.fuel_rate, s.maf, s.oil_temp, s.load = new
+    else:
+        new = step(s["rpm"], s["speed"], s["throttle"], s["coolant_temp"], s["oil_temp"], s["load"],
+                   accel_request, road_slope, dt, rng)
+        s["rpm"], s["speed"], s["throttle"], s["coolant_temp"], s["fuel_rate"], s["maf"], s["oil_temp"], s["load"] = new
 
+    if emit_faults:
+        rpm, coolant_temp, oil_temp = new[0], new[3], new[6]
+        return s, _faults_for(coolant_temp, rpm, oil_temp, rng)
     return s
 
-def check_faults(state):
+# Display precision per field (None rounds to a whole int)
+_DECIMALS = {
+    "rpm": None,
+    "speed": 1,
+    "throttle": 1,
+    "coolant_temp": 1,
+    "fuel_rate": 3,
+    "maf": 2,
+    "oil_temp": 1,
+    "load": 1,
+}
+
+def format_state(s):
+    """Copy of the state (dict or VehicleState) rounded for display / JSON output."""
+    if isinstance(s, VehicleState):
+        s = s.to_dict()
+    return {k: round(v, _DECIMALS[k]) for k, v in s.items()}
+
+# Vehicle frame: one vehicle's fields as little-endian float32, in FIELDS
+# order. Concatenated frames are vehicle-major; this is NOT the field-major
+# fleet block layout of fleet.states_to_bytes().
+_STATE_STRUCT = struct.Struct("<" + "f" * len(FIELDS))
+
+def pack_state(state):
+    """
+    Pack a state (dict or VehicleState) into a 32-byte vehicle frame.
+    A run of concatenated frames decodes to one row per vehicle with
+    np.frombuffer(buf, dtype="<f4").reshape(-1, 8); use
+    fleet.states_from_bytes() for fleet blocks instead.
+    """
+    if isinstance(state, VehicleState):
+        return _STATE_STRUCT.pack(*[getattr(state, f) for f in FIELDS])
+    return _STATE_STRUCT.pack(*[state[f] for f in FIELDS])
+
+def unpack_state(buf):
+    """Inverse of pack_state(); returns a state dict."""
+    return dict(zip(FIELDS, _STATE_STRUCT.unpack(buf)))
+
+def check_faults(state, rng=None):
     """
     Basic fault generator logic (Phase 1: simulated).
+    - rng: random.Random for the misfire roll (this thread's generator if None)
     Returns a list of fault dicts (code, description, severity).
     """
+    if isinstance(state, VehicleState):
+        return _faults_for(state.coolant_temp, state.rpm, state.oil_temp, rng)
+    return _faults_for(state["coolant_temp"], state["rpm"], state["oil_temp"], rng)
+
+# Fault definitions, in rule order: overtemperature, misfire, cold oil.
+# Each raised fault is a fresh copy, so callers may modify what they get.
+FAULT_TEMPLATES = (
+    {"code": "P0217", "desc": "Engine Overtemperature", "severity": "High"},
+    {"code": "P0300", "desc": "Random/Multiple Cylinder Misfire Detected", "severity": "Medium"},
+    {"code": "INFO001", "desc": "Oil temperature below optimal", "severity": "Info"},
+)
+_OVERTEMP, _MISFIRE, _COLD_OIL = FAULT_TEMPLATES
+
+def _faults_for(coolant_temp, rpm, oil_temp, rng=None):
     faults = []
     # Example: if coolant_temp too high
-    if state["coolant_temp"] > 105:
-        faults.append({"code": "P0217", "desc": "Engine Overtemperature", "severity": "High"})
+    if coolant_temp > 105:
+        faults.append(_OVERTEMP.copy())
     # Example: rough idle or misfire (random chance when rpm fluctuates)
-    if state["rpm"] < 700 and random.random() < 0.02:
-        faults.append({"code": "P0300", "desc": "Random/Multiple Cylinder Misfire Detected", "severity": "Medium"})
+    if rpm < 700 and (_rng() if rng is None else rng).random() < 0.02:
+        faults.append(_MISFIRE.copy())
     # Low oil temp (cold start) — not a fault but info
-    if state["oil_temp"] < 40:
-        faults.append({"code": "INFO001", "desc": "Oil temperature below optimal", "severity": "Info"})
+    if oil_temp < 40:
+        faults.append(_COLD_OIL.copy())
     return faults